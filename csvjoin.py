@@ -35,7 +35,10 @@ colums, we would use:
 """
 
 import argparse
-import functools
+import ast
+import bisect
+import csv
+import operator
 import re
 import sys
 
@@ -55,12 +58,26 @@ default_values = {
 
 
 COLUMN_NAME_RE = r"\d+\:[\w\d_]+"
+COLUMN_NAME_PATTERN = re.compile(COLUMN_NAME_RE)
+# ensure end-to-end match
+FULL_COLUMN_NAME_PATTERN = re.compile(r"^%s$" % COLUMN_NAME_RE)
+
+# number of output rows written at once
+OUTPUT_BATCH_SIZE = 4096
+
+# binary operators that can be run without evaluating an expression
+operators = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+    ast.BitXor: operator.xor,
+}
 
 
 def is_column_name(colname):
-    # ensure end-to-end match
-    column_name_re = r"^%s$" % COLUMN_NAME_RE
-    return re.match(column_name_re, colname) is not None
+    return FULL_COLUMN_NAME_PATTERN.match(colname) is not None
 
 
 def parse_column_name(colname, colnames_list):
@@ -69,9 +86,31 @@ def parse_column_name(colname, colnames_list):
     return i, colnames_list[i].index(field)
 
 
+def parse_value(val):
+    # interpret a CSV item as a python value (numbers first)
+    for conv in (int, float):
+        try:
+            return conv(val)
+        except ValueError:
+            pass
+    try:
+        return ast.literal_eval(val)
+    except (SyntaxError, ValueError):
+        raise Exception("error: invalid value in expression (%s)" % val)
+
+
+# Expressions do not access the matched rows directly. Instead, all the
+# (file, column, numeric) cells used by any expression are stored in a
+# shared dictionary (cell_dict) that maps them to their offset in a flat
+# list of values. For each match, only those cells are gathered, and
+# the ones used in expressions (numeric) are parsed only once.
+def get_cell_offset(cell, cell_dict):
+    return cell_dict.setdefault(cell, len(cell_dict))
+
+
 class Expression(object):
 
-    def __init__(self, colname, colnames_list):
+    def __init__(self, colname, colnames_list, cell_dict):
         if is_column_name(colname):
             # column cointains a simple value
             self.expr_ = ""
@@ -79,58 +118,74 @@ class Expression(object):
                 self.pars_ = parse_column_name(colname, colnames_list)
             except ValueError:
                 raise Exception("error: unknown column name (%s)" % colname)
+            cell = (*self.pars_, False)
+            self.getter_ = operator.itemgetter(get_cell_offset(cell, cell_dict))
         else:
             # column cointains an expression
             self.pars_ = []
-            pos_list = []
-            for match in re.finditer(COLUMN_NAME_RE, colname):
-                # store the positions
-                pos_list.append(match.span())
+            self.names_ = []
+
+            def replace_column_name(match):
                 # parse the column name
                 try:
                     self.pars_.append(parse_column_name(match.group(), colnames_list))
                 except ValueError:
                     raise Exception("error: unknown column name (%s)" % match.group())
-            # fix the positions
-            for i, j in reversed(pos_list):
-                colname = colname[:i] + "{}" + colname[j:]
-            self.expr_ = colname
+                # replace it with a variable ("__v<k>")
+                self.names_.append("__v%i" % len(self.names_))
+                return self.names_[-1]
+
+            self.expr_ = COLUMN_NAME_PATTERN.sub(replace_column_name, colname)
+            self.offsets_ = [
+                get_cell_offset((i, j, True), cell_dict) for i, j in self.pars_
+            ]
+            # get a function that evaluates the expression (only once)
+            node = ast.parse(self.expr_, mode="eval").body
+            if (
+                isinstance(node, ast.BinOp)
+                and type(node.op) in operators
+                and [getattr(n, "id", None) for n in (node.left, node.right)]
+                == self.names_
+            ):
+                # "<column> <op> <column>": use the operator directly
+                self.func_ = operators[type(node.op)]
+            else:
+                # generate a function from the expression
+                func_src = "lambda %s: %s" % (", ".join(self.names_), self.expr_)
+                self.func_ = eval(compile(func_src, "<expr>", "eval"), {})
 
-    def run(self, lines):
+    def run(self, cells):
         if not self.expr_:
             # return the simple value
-            return lines[self.pars_[0]][self.pars_[1]]
+            return self.getter_(cells)
         else:
-            vals = ((lines[i][j]) for i, j in self.pars_)
+            vals = (cells[k] for k in self.offsets_)
             # eval the value
-            return str(eval(self.expr_.format(*vals)))
-
+            return str(self.func_(*vals))
 
-def read_data(infile):
-    # open infile
-    if infile == "-":
-        infile = "/dev/fd/0"
-    with open(infile, "r") as fin:
-        # read data
-        raw_data = fin.read()
-    return raw_data
 
-
-def parse_csv(raw_data, sep):
-    # split the input in lines
-    lines = raw_data.split("\n")
-    # look for named columns in line 0
+def parse_csv(fin, sep):
     column_names = []
-    if lines[0].strip().startswith("#"):
-        column_names = lines[0].strip()[1:].strip().split(sep)
-        # remove spaces
-        column_names = [colname.strip() for colname in column_names]
-    # remove comment lines
-    lines = [
-        line.split(sep) for line in lines if line and not line.strip().startswith("#")
-    ]
-    # strip spaces from items
-    lines = [[item.strip() for item in line] for line in lines]
+    lines = []
+    if len(sep) == 1:
+        reader = csv.reader(fin, delimiter=sep, skipinitialspace=True)
+    else:
+        # csv only supports 1-character separators (no quoting support)
+        reader = (line.split(sep) for line in fin)
+    for row_num, row in enumerate(reader):
+        # strip spaces from items
+        row = [item.strip() for item in row]
+        # remove empty lines
+        if not row or row == [""]:
+            continue
+        if row[0].startswith("#"):
+            # look for named columns in line 0
+            if row_num == 0:
+                row[0] = row[0][1:].strip()
+                column_names = row
+            # remove comment lines
+            continue
+        lines.append(row)
     return column_names, lines
 
 
@@ -174,42 +229,66 @@ def get_field_list(infile_list, join_list, colnames_list):
 #   the first source (but do not move the remaining N-1 counters)
 # * if there is a match for all of them, add a new match to the match
 #   list, and move all the counters to the next element
+# Instead of re-scanning the N-1 sources for every row of the first one,
+# we build (once per source) a hash index mapping each join value to the
+# (ascending) list of rows where it appears. Looking for a match then
+# means getting (using a binary search) the first indexed row at or after
+# the source counter.
+# Join values are first factorized into integer codes (shared across all
+# the sources), so that the index and the probes work on ints instead of
+# strings.
+def get_join_codes(lines_list, join_field_list):
+    code_dict = {}
+    codes_list = []
+    for lines, join_field in zip(lines_list, join_field_list):
+        codes_list.append(
+            [code_dict.setdefault(row[join_field], len(code_dict)) for row in lines]
+        )
+    return codes_list
+
+
+def get_index(codes):
+    index = {}
+    for row_idx, code in enumerate(codes):
+        index.setdefault(code, []).append(row_idx)
+    return index
+
+
 def get_match_list(lines_list, join_field_list):
-    # create counters for each file
+    # factorize the join values
+    codes_list = get_join_codes(lines_list, join_field_list)
+    # create counters and indices for each file
     ii = [0] * len(lines_list)
+    lens = [len(lines) for lines in lines_list]
+    index_list = [get_index(codes) for codes in codes_list[1:]]
+    # join values that appear in all the other files (any other value
+    # cannot produce a match)
+    common_codes = set(codes_list[0]).intersection(*index_list)
+    bisect_left = bisect.bisect_left
     match_list = []
 
-    def no_finished_list(ii, lines_list):
-        return functools.reduce(
-            bool.__and__, [(ii[i] < len(lines_list[i])) for i in range(len(ii))]
-        )
-
-    while no_finished_list(ii, lines_list):
-        match = []
-        # get the join value from the first file
-        i = 0
-        join_value = lines_list[i][ii[i]][join_field_list[i]]
-        match.append(ii[i])
+    for row_idx, join_code in enumerate(codes_list[0]):
+        # get the join value (code) from the first file
+        if join_code not in common_codes:
+            continue
+        match = [row_idx]
         # check for it in all the other files
-        match_found = True
-        for i in range(1, len(lines_list)):
-            for j in range(ii[i], len(lines_list[i])):
-                jv = lines_list[i][j][join_field_list[i]]
-                if jv == join_value:
-                    match.append(j)
-                    break
-            else:
-                # column does not match:
-                match_found = False
+        for i, index in enumerate(index_list, start=1):
+            # look for the first candidate row at or after the counter
+            candidates = index[join_code]
+            k = bisect_left(candidates, ii[i])
+            if k == len(candidates):
+                # column does not match
+                break
+            match.append(candidates[k])
+        else:
+            # match
+            match_list.append(match)
+            # update counters
+            ii = [i + 1 for i in match]
+            # no more matches are possible once any file is finished
+            if any(i >= n for i, n in zip(ii[1:], lens[1:])):
                 break
-        if not match_found:
-            ii[0] += 1
-            continue
-        # match
-        match_list.append(match)
-        # update counters
-        ii = match
-        ii = [i + 1 for i in ii]
     return match_list
 
 
@@ -292,11 +371,13 @@ def main(argv):
         print(options)
 
     # read all the input fields
-    # TODO(chema): there should be a less memory-constrained way to do this
     colnames_list = []
     lines_list = []
     for infile in options.infile:
-        colnames, lines = parse_csv(read_data(infile), options.sep)
+        if infile == "-":
+            infile = "/dev/fd/0"
+        with open(infile, "r", newline="") as fin:
+            colnames, lines = parse_csv(fin, options.sep)
         colnames_list.append(colnames)
         lines_list.append(lines)
 
@@ -308,16 +389,28 @@ def main(argv):
 
     # pre-process the output columns
     expr_list = []
+    cell_dict = {}
     for colname in options.out_cols:
-        expr_list.append(Expression(colname, colnames_list))
+        expr_list.append(Expression(colname, colnames_list, cell_dict))
+    cell_list = [(i, j) for i, j, _ in cell_dict]
+    # numeric cells are parsed when gathered (other cells are kept verbatim)
+    numeric_offsets = [k for k, (_, _, numeric) in enumerate(cell_dict) if numeric]
 
     # open outfile
-    with open(options.outfile, "w") as fout:
-        # run all the matches
+    with open(options.outfile, "w", newline="") as fout:
+        out_writer = csv.writer(fout, lineterminator="\n")
+        # run all the matches (writing the output rows in batches)
+        out_rows = []
         for row_list in match_list:
-            lines = list(l[i] for i, l in zip(row_list, lines_list))
-            out_cols = [expr.run(lines) for expr in expr_list]
-            fout.write(",".join(out_cols) + "\n")
+            # only get the cells used by the output columns
+            cells = [lines_list[i][row_list[i]][j] for i, j in cell_list]
+            for k in numeric_offsets:
+                cells[k] = parse_value(cells[k])
+            out_rows.append([expr.run(cells) for expr in expr_list])
+            if len(out_rows) >= OUTPUT_BATCH_SIZE:
+                out_writer.writerows(out_rows)
+                out_rows.clear()
+        out_writer.writerows(out_rows)
 
 
 if __name__ == "__main__":
@@ -32,31 +32,31 @@ operators = {
 }
 
 
-def eval_expr(expr, variables):
+def compile_expr(expr):
     """
-    Evaluate a mathematical expression with given variables.
+    Compile a mathematical expression into a reusable evaluator.
 
-    :param expr: The expression to evaluate (as a string).
-    :param variables: A dictionary of variable values.
-    :return: The result of the evaluated expression.
+    :param expr: The expression to compile (as a string).
+    :return: A function that takes a dictionary of variable values, and
+        returns the result of the evaluated expression.
     """
 
-    # parse the expression into an AST
+    # parse the expression into an AST (only once)
     node = ast.parse(expr, mode="eval").body
 
-    def _eval(node):
+    def _eval(node, variables):
         if isinstance(node, ast.Constant):  # <number>
             return node.value
         elif isinstance(node, ast.BinOp):  # <left> <operator> <right>
-            left = _eval(node.left)
-            right = _eval(node.right)
+            left = _eval(node.left, variables)
+            right = _eval(node.right, variables)
             return operators[type(node.op)](left, right)
         elif isinstance(node, ast.Name):
             return variables[node.id]
         else:
             raise TypeError(node)
 
-    return _eval(node)
+    return lambda variables: _eval(node, variables)
 
 
 def add_column(infile, column_name, equation, outfile, header):
@@ -75,13 +75,39 @@ def add_column(infile, column_name, equation, outfile, header):
     equation = re.sub(r"\$(\d+)", replacer, equation)
     num_cols = df.shape[1]
     # create a new column
-    for tup in df.itertuples():
-        variables = tup._asdict()
-        for i in range(num_cols + 1):
-            variables[f"column_{i}"] = tup[i]
-        new_value = eval_expr(equation, variables)
-        index = tup[0]
-        df.loc[index, column_name] = new_value
+    try:
+        # evaluate the equation on whole columns at once (pandas will use
+        # numexpr if available). Integer columns are converted to float
+        # first, so that results do not overflow (int64 arithmetic wraps).
+        float_df = df.astype(
+            {col: float for col in df.columns if pd.api.types.is_integer_dtype(df[col])}
+        )
+        column_resolver = {
+            f"column_{i + 1}": float_df.iloc[:, i] for i in range(num_cols)
+        }
+        df[column_name] = float_df.eval(equation, resolvers=[column_resolver])
+    except (
+        AttributeError,
+        KeyError,
+        NameError,
+        NotImplementedError,
+        SyntaxError,
+        TypeError,
+        ValueError,
+    ):
+        # fall back to row-by-row evaluation
+        expr_fun = compile_expr(equation)
+        new_column = []
+        for tup in df.itertuples():
+            variables = tup._asdict()
+            for i in range(num_cols + 1):
+                variables[f"column_{i}"] = tup[i]
+            new_column.append(expr_fun(variables))
+        # assign the full column at once
+        df[column_name] = new_column
+    # new numeric columns are always written as floats
+    if pd.api.types.is_integer_dtype(df[column_name]):
+        df[column_name] = df[column_name].astype(float)
     # write csv
     df.to_csv(outfile, header=header, index=False)
 
@@ -76,16 +76,22 @@ def main(argv):
     if options.debug > 0:
         print(options)
 
-    # read the input
+    # read the input, rotating it as we go (columns become rows)
+    output_data = None
     with open(options.infile, "r") as fin:
-        input_data = csv.reader(fin.read().splitlines())
-
-    # rotate it
-    output_data = zip(*input_data)
+        for row in csv.reader(fin):
+            if output_data is None:
+                output_data = [[] for _ in row]
+            elif len(row) < len(output_data):
+                # only keep the columns present in all the rows
+                del output_data[len(row) :]
+            for col, val in zip(output_data, row):
+                col.append(val)
 
     # write it as output
-    out_writer = csv.writer(open(options.outfile, "w"))
-    out_writer.writerows(output_data)
+    with open(options.outfile, "w") as fout:
+        out_writer = csv.writer(fout)
+        out_writer.writerows(output_data or [])
 
 
 if __name__ == "__main__":